@@ -2,25 +2,35 @@ import pandas as pd
 import numpy as np
 import math
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import glob
-import sys
 import os
-from io import (StringIO, BytesIO)
+from io import BytesIO
 import time
+import threading
 import datetime
 import pytz
+from collections import deque
+from email.utils import parsedate_to_datetime
 from joblib import (Parallel, delayed)
 from azure.identity import DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
 from shareplum import (Site, Office365)
 from shareplum.site import Version
+from importlib.util import find_spec
+# Use pyarrow's multithreaded CSV reader if available, otherwise fall back to pandas' default C engine
+engine_csv = "pyarrow" if find_spec("pyarrow") else "c"
+if engine_csv == "pyarrow":
+    from pyarrow import (csv as pa_csv, string as pa_string)
 
 # Init script execution time for logging purposes
 start_time = datetime.datetime.now().astimezone(pytz.timezone("Australia/Sydney"))
 
 # Limit Intel MKL and OpenMP to single-threaded execution to prevent thread oversubscription
 # Oversubscription can cause code execution for parallelization to be stuck
+# API calls are parallelized with threads that only wait on I/O & aren't affected by this
 os.environ["MKL_NUM_THREADS"] = "1"
 os.environ["OMP_NUM_THREADS"] = "1"
 os.environ["MKL_DYNAMIC"] = "FALSE"
@@ -28,10 +38,32 @@ os.environ["MKL_DYNAMIC"] = "FALSE"
 # Init credential secrets from Azure Key Vault
 vault_name = ""
 url_vault = f"https://{vault_name}.vault.azure.net/"
-client_vault = SecretClient(vault_url = url_vault, credential = DefaultAzureCredential())
-api_token_ActiveCampaign = client_vault.get_secret("API_TOKEN_ActiveCampaign").value
-username_sharepoint = client_vault.get_secret("username_SharePoint").value
-password_sharepoint = client_vault.get_secret("password_SharePoint").value
+# Single credential & client shared by all secret lookups so the AAD token can be reused across them
+# Interactive browser probe is skipped as the script runs unattended, & retries are reduced to fail fast
+client_vault = SecretClient(vault_url = url_vault, 
+                            credential = DefaultAzureCredential(exclude_interactive_browser_credential = True), 
+                            retry_total = 3)
+cache_secrets = dict()
+
+# Helper function to get secrets from Azure Key Vault
+# First secret is fetched on its own so the client completes the auth challenge & caches the AAD token, 
+# then the rest are fetched concurrently reusing that token
+# Results are memoized in `cache_secrets` so repeated lookups in the same process skip Key Vault
+def get_secrets(names):
+    _names = [i for i in names if i not in cache_secrets]
+    if _names:
+        cache_secrets[_names[0]] = client_vault.get_secret(_names[0]).value
+    if _names[1:]:
+        _secrets = Parallel(n_jobs = len(_names[1:]), backend = "threading", verbose = 0)(
+            delayed(client_vault.get_secret)(i) for i in _names[1:]
+            )
+        cache_secrets.update({i: j.value for i, j in zip(_names[1:], _secrets)})
+    
+    return [cache_secrets[i] for i in names]
+
+api_token_ActiveCampaign, username_sharepoint, password_sharepoint = get_secrets(
+    ["API_TOKEN_ActiveCampaign", "username_SharePoint", "password_SharePoint"]
+    )
 
 # Init SharePoint path dirs to process the relevant files 
 url_sharepoint = "https://heartresearchinstitute.sharepoint.com"
@@ -55,6 +87,48 @@ folder_sharepoint_log_dump = Site(f"{url_sharepoint}/{site_sharepoint_log_dump}"
 files_sharepoint_from_JO = folder_sharepoint_from_JO.files
 files_sharepoint_from_NO = folder_sharepoint_from_NO.files
 
+# Init local copy of the last uploaded runtime log file & the SharePoint metadata it was uploaded as
+# Lets the next run skip downloading the whole log history when the SharePoint file is unchanged
+path_log_cache = os.path.join(os.path.expanduser("~"), ".ac_runtime_logs.csv")
+path_log_state = os.path.join(os.path.expanduser("~"), ".ac_log_state.json")
+
+# Init ActiveCampaign List IDs to subscribe welcome mailing list contacts to, matched by file name keyword
+lists_from_JO = [
+    ("Welcome", "71"), # Donor Series - Welcome - Australia
+    ("1stWeekEmail", "26"), # Donor Series - Australia
+    ("2ndMonthEmail", "246"), # Donor Series - Month 2 - Australia
+    ("3rdMonthEmail", "241"), # Donor Series - Month 3 - Australia
+    ("2YearEmail", "72") # Donor Series - 2 Years - Australia
+]
+
+# Init ActiveCampaign custom field IDs & their corresponding source file columns
+fields_from_JO = [
+    (2, "SerialNum"), # RE - Constituent ID
+    (5, "Title"), # Title
+    (24, "Address"), # Address
+    (25, "Suburb"), # Suburb
+    (26, "State"), # State
+    (27, "Postcode"), # Postcode
+    (28, "DOB"), # DOB
+    (29, "1stDebitDate"), # 1stDebitDate
+    (30, "Amount") # Amount
+]
+fields_from_NO = [
+    (2, "Constituent Number"), # RE - Constituent ID
+    (5, "Title"), # Title
+    (96, "Appeal"), # Appeal ID
+    (97, "Package"), # Package ID
+    (134, "Description"), # Description
+    (113, "Informal Salutation"), # Informal Salutation
+    (46, "Fullname") # First & Last Name
+]
+# Init columns needed per contact from a source file, in the order they're unpacked
+# Only these columns are converted to lists, however wide the source sheet is
+fields_id_from_JO = [k for k, _ in fields_from_JO]
+fields_id_from_NO = [k for k, _ in fields_from_NO]
+columns_from_JO = ["Email", "FirstName", "Surname", "Mobile", *(v for _, v in fields_from_JO)]
+columns_from_NO = ["Email Address", "First name", "Last name", "tag", "listid", *(v for _, v in fields_from_NO)]
+
 # Init vars for collating unsubbed & bounced contacts
 url_bulk_import_contact = "https://hri618.api-us1.com/api/3/import/bulk_import"
 headers_post_bulk_import_contact = {
@@ -73,169 +147,334 @@ end_date = start_date \
            + datetime.timedelta(days = (7 * weekly_multiplier) + 1)
 url_bounced_contact = "https://hri618.api-us1.com/api/3/contacts?status=3"
 url_unsubbed_contact = "https://hri618.api-us1.com/api/3/contacts?status=2"
+# Unsubbed contacts are filtered server-side by updated date, which is set when a contact unsubscribes
+# Bounced contacts have no bounced date range filter so are requested latest bounce first instead
+# `orders[bounceddate]` hasn't been verified against the live API, so the returned order is checked 
+# before relying on it
+params_bounced_contact = {
+    "orders[bounceddate]": "DESC"
+}
+params_unsubbed_contact = {
+    "filters[updated_after]": start_date.isoformat(),
+    "filters[updated_before]": end_date.isoformat()
+}
 headers_get_bounced_unsubbed_contact = {
     "accept": "application/json",
     "Api-Token": api_token_ActiveCampaign
 }
+# Single session shared by all worker threads & requests to reuse pooled keep-alive connections to ActiveCampaign
+# Transient connection errors are retried with a short backoff
+# 429 Too Many Requests isn't retried here, as it's handled through the rate limiter by each request instead
+session = requests.Session()
+session.headers.update(headers_get_bounced_unsubbed_contact)
+session.mount("https://", HTTPAdapter(pool_connections = 10, pool_maxsize = 20, 
+                                      max_retries = Retry(total = 3, backoff_factor = 0.3, 
+                                                          respect_retry_after_header = False)))
+
+# Helper class to limit requests to ActiveCampaign's API policy of max 5 requests per second
+# Sliding window of request timestamps shared by all worker threads, so a worker only blocks 
+# when the window is actually full instead of sleeping after every request
+class RateLimiter:
+    def __init__(self, max_calls, period):
+        self.max_calls = max_calls
+        self.period = period
+        self.lock = threading.Lock()
+        self.calls = deque()
+        self.resume_at = 0
+
+    # Hold off all requests for the given seconds, e.g. when the API responds with 429 Too Many Requests
+    def pause(self, seconds):
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    def acquire(self):
+        with self.lock:
+            time.sleep(max(0, self.resume_at - time.monotonic()))
+            now = time.monotonic()
+            while self.calls and now - self.calls[0] >= self.period:
+                self.calls.popleft()
+            if len(self.calls) >= self.max_calls:
+                time.sleep(self.period - (now - self.calls.popleft()))
+            self.calls.append(time.monotonic())
+
+bucket = RateLimiter(max_calls = 5, period = 1)
 
 # Helper function to parse payload to be at most about 90% of max allowable size of 
 # <= 400k B for each bulk import POST request
 # Max allowable size is per ActiveCampaign's docs & 90% limit is arbitrarily chosen 
 # as buffer for guaranteed safe POST request
+# Contacts are walked once, accumulating each one's compact UTF-8 encoded JSON size & cutting a new chunk 
+# whenever the running size would cross the limit
 def payload_parser(payload):
+    # +1 per contact for the separating comma
+    _sizes = [len(json.dumps(i, separators = (",", ":"), allow_nan = False).encode("utf-8")) + 1 
+              for i in payload["contacts"]]
+    # Whole payload fits into a single POST request, so there's nothing to chunk
+    if sum(_sizes) <= 360000:
+        return [0, len(_sizes)] if _sizes else [0]
     list_index = [0]
-    len_payload = len(payload["contacts"])
-    payload_size_bytes = sys.getsizeof(json.dumps(payload["contacts"]))
-    while list_index[-1] < len_payload:
-        last_index = list_index[-1] + int(360000 / payload_size_bytes * len_payload) + 1
-        list_index.append(last_index)
-    list_index[-1] = len_payload 
+    size = 0
+    for i, _size in enumerate(_sizes):
+        if size and size + _size > 360000:
+            list_index.append(i)
+            size = 0
+        size += _size
+    list_index.append(len(_sizes))
         
     return list_index
 
-# Helper function to get all bounced contacts
-# Has to get all as there's no functionality to filter based on bounced date range
-def get_bounced_contacts(index):
-    _response = requests.get(url_bounced_contact, headers = headers, 
-                             params = {"limit": 100, "offset": 100 * index})
-    _response = [
-        {k: index[k] for k in ["email", "firstName", "lastName", "bounced_date", "id"] if k in index} \
-        for index in _response.json()["contacts"]
-    ]
-    time.sleep(1) # Limiter to accomodate ActiveCampaign's API policy of max 5 requests per second 
+# Helper function to deduplicate contacts by email so each contact is only imported once
+# Last occurrence is kept with the tags & lists to subscribe to of all its duplicates merged into it
+def dedupe_contacts(contacts):
+    _contacts = dict()
+    for i in contacts:
+        _key = i["email"].strip().lower() if isinstance(i["email"], str) else id(i)
+        if _key in _contacts:
+            i = {
+                **i,
+                "tags": list(dict.fromkeys(_contacts[_key]["tags"] + i["tags"])),
+                "subscribe": list({j["listid"]: j for j in _contacts[_key]["subscribe"] + i["subscribe"]}.values())
+            }
+        _contacts[_key] = i
+    
+    return list(_contacts.values())
+
+# Helper function to get the seconds to wait from a `Retry-After` header, given either as seconds or as an HTTP-date
+# Missing or unparseable values fall back to waiting 1 second
+def parse_retry_after(value):
+    try:
+        return max(0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0, (parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return 1
+
+# Helper function to GET a page of contacts
+# On 429 Too Many Requests all requests are held off for the advised `Retry-After` before trying again
+def get_contacts_page(url, params):
+    for _ in range(3):
+        bucket.acquire()
+        _response = session.get(url, params = params)
+        if _response.status_code != 429:
+            break
+        bucket.pause(parse_retry_after(_response.headers.get("Retry-After")))
+    _response.raise_for_status()
+    
+    return _response.json()
+
+# Helper function to POST a chunk of contacts for bulk import
+# On 429 Too Many Requests all requests are held off for the advised `Retry-After` before trying again
+def post_bulk_import(contacts):
+    for _ in range(3):
+        bucket.acquire()
+        _response = session.post(url_bulk_import_contact, 
+                                 data = json.dumps({"contacts": contacts}, separators = (",", ":"), allow_nan = False), 
+                                 headers = headers_post_bulk_import_contact)
+        if _response.status_code != 429:
+            break
+        bucket.pause(parse_retry_after(_response.headers.get("Retry-After")))
+    _response.raise_for_status()
     
     return _response
 
-# Helper function to get all unsubbed contacts
-# Has to get all as there's no functionality to filter based on unsubbed date range
-def get_unsubbed_contacts(index):
-    _response = requests.get(url_unsubbed_contact, headers = headers, 
-                             params = {"limit": 100, "offset": 100 * index})
-    _response = [
-        {k: index[k] for k in ["email", "firstName", "lastName", "cdate", "udate", "id"] if k in index} \
-        for index in _response.json()["contacts"]
-    ]
-    time.sleep(1) # Limiter to accomodate ActiveCampaign's API policy of max 5 requests per second 
+# Helper function to parallelize bulk importing contacts in payload sized chunks
+# Threads share the session & rate limiter so up to 5 POST requests are in flight within the API's limit
+def import_contacts(contacts):
+    payload_index = payload_parser({"contacts": contacts})
+    _response = Parallel(n_jobs = 5, backend = "threading", verbose = 0)(
+        delayed(post_bulk_import)(contacts[i : j]) for i, j in zip(payload_index, payload_index[1:])
+        )
     
     return _response
 
-# Helper function to parallelize getting all bounced or unsubbed contacts
-def process_contacts(iterator, kind):
-    list_response = []
-    if kind == "bounced":
-        _response = Parallel(n_jobs = 5, verbose = 0)(
-            delayed(get_bounced_contacts)(i) for i in iterator
-            )
-        list_response.extend(_response)
-    if kind == "unsubbed":
-        _response = Parallel(n_jobs = 5, verbose = 0)(
-            delayed(get_unsubbed_contacts)(i) for i in iterator
-            )
-        list_response.extend(_response)
+# Helper function to read the first sheet of an Excel file downloaded from SharePoint
+# File content is kept as raw bytes as Excel workbooks are binary & can't be decoded as UTF-8
+# `.xlsx` is parsed with openpyxl while legacy `.xls` falls back to xlrd
+def read_excel_file(content, name):
+    _engine = "openpyxl" if name.endswith(".xlsx") else "xlrd"
+    with pd.ExcelFile(BytesIO(content), engine = _engine) as xl:
+        _df = xl.parse(xl.sheet_names[0])
     
-    return list_response
+    return _df
 
-# Helper function to get `RE - Constituent ID` for each bounced or unsubbed contact
+# Helper function to read a CSV file downloaded from SharePoint straight from its raw bytes
+# Columns in `columns_str` are kept as the text as written by either reader, as pyarrow would otherwise parse 
+# date-like columns into timestamps, so values posted to ActiveCampaign don't depend on pyarrow being installed
+# pyarrow is called directly as pandas' pyarrow engine only applies `dtype` after inferring column types
+def read_csv_file(content, columns_str):
+    if engine_csv == "pyarrow":
+        _df = pa_csv.read_csv(BytesIO(content), convert_options = pa_csv.ConvertOptions(
+            column_types = {i: pa_string() for i in columns_str}, strings_can_be_null = True
+            )).to_pandas()
+        # Blanks come back as None rather than NaN like the C engine
+        _df[columns_str] = _df[columns_str].where(_df[columns_str].notna(), np.nan)
+    else:
+        _df = pd.read_csv(BytesIO(content), dtype = {i: "str" for i in columns_str})
+    
+    return _df
+
+# Helper function to get `RE - Constituent ID` for each bounced or unsubbed contact in a page
 # `RE - Constituent ID` is a custom field that corresponds to HRI's internal CRM contact ID 
-def get_contacts_cons_id(cons_id):
-    _url = f"https://hri618.api-us1.com/api/3/contacts/{cons_id}"
-    _response = requests.get(_url, headers = headers_get_bounced_unsubbed_contact)
-    _cons_id = [np.nan if len([i for i in _response.json()["fieldValues"] if i["field"] == "2"]) == 0 \
-                else [i for i in _response.json()["fieldValues"] if i["field"] == "2"][0]["value"]][0]
-    time.sleep(1) # Limiter to accomodate ActiveCampaign's API policy of max 5 requests per second 
+# Field values are sideloaded in the same GET via `include=fieldValues` & linked back by contact ID
+def map_cons_id(response):
+    _cons_id = {i["contact"]: i["value"] for i in response.get("fieldValues", []) if i["field"] == "2"}
     
     return _cons_id
 
-# Helper function to parallelize getting all `RE - Constituent ID` for each bounced or unsubbed contact
-def process_cons_id(iterator):
-    list_cons_id = []
-    _cons_id = Parallel(n_jobs = 5, verbose = 0)(
-        delayed(get_contacts_cons_id)(i) for i in iterator
-        )
-    list_cons_id.extend(_cons_id)
+# Helper function to get a page of bounced contacts, latest bounce first
+# Also returns the total number of bounced contacts as reported with every page
+def get_bounced_contacts(index):
+    _response = get_contacts_page(url_bounced_contact, 
+                                  {**params_bounced_contact, "limit": 100, "offset": 100 * index, 
+                                   "include": "fieldValues"})
+    _total = int(_response["meta"]["total"])
+    _cons_id = map_cons_id(_response)
+    _columns = ["email", "firstName", "lastName", "bounced_date", "id"]
+    # Page is returned as its own DataFrame with all values kept as strings as returned by the API
+    _response = pd.DataFrame([
+        {**{k: contact[k] for k in _columns if k in contact}, 
+         "RE - Constituent ID": _cons_id.get(contact["id"], np.nan)} \
+        for contact in _response["contacts"]
+    ], columns = _columns + ["RE - Constituent ID"], dtype = "object")
+    
+    return _response, _total
+
+# Helper function to get a page of contacts unsubbed within the date range
+# Also returns the total number of unsubbed contacts as reported with every page
+def get_unsubbed_contacts(index):
+    _response = get_contacts_page(url_unsubbed_contact, 
+                                  {**params_unsubbed_contact, "limit": 100, "offset": 100 * index, 
+                                   "include": "fieldValues"})
+    _total = int(_response["meta"]["total"])
+    _cons_id = map_cons_id(_response)
+    _columns = ["email", "firstName", "lastName", "cdate", "udate", "id"]
+    # Page is returned as its own DataFrame with all values kept as strings as returned by the API
+    _response = pd.DataFrame([
+        {**{k: contact[k] for k in _columns if k in contact}, 
+         "RE - Constituent ID": _cons_id.get(contact["id"], np.nan)} \
+        for contact in _response["contacts"]
+    ], columns = _columns + ["RE - Constituent ID"], dtype = "object")
+    
+    return _response, _total
+
+# Helper function to get metadata of the runtime log file on SharePoint, or None if it doesn't exist yet
+# Used to check whether the local copy of the log file is still the latest version
+def get_log_state():
+    _log = next((i for i in folder_sharepoint_log_dump.files if i["Name"] == "runtime_logs.csv"), None)
+    _state = None if _log is None else {k: _log.get(k) for k in ["ETag", "Length", "TimeLastModified"]}
+    
+    return _state
+
+# Helper function to check bounced contact pages fetched so far are really ordered latest bounce first
+# Bounced dates must never increase within or across pages for pagination to safely stop early
+def is_bounced_desc(pages):
+    _dates = pd.concat([i["bounced_date"] for i in pages], ignore_index = True).dropna().str[:10]
+    
+    return _dates.is_monotonic_decreasing
+
+# Helper function to read the SharePoint metadata the local copy of the log file was uploaded as
+# A missing, unreadable or corrupt state file is treated as a cache miss so the log file gets downloaded instead
+def read_log_state():
+    try:
+        with open(path_log_state) as f:
+            _state = json.load(f)
+    except (OSError, ValueError):
+        _state = None
     
-    return list_cons_id
+    return _state
+
+# Helper function to parallelize getting all bounced or unsubbed contacts
+# Threads rather than processes as workers only wait on HTTP, sharing the session & rate limiter
+# More workers than the 5 requests per second limit keeps the window full while responses are in flight
+def process_contacts(kind):
+    get_contacts = get_bounced_contacts if kind == "bounced" else get_unsubbed_contacts
+    # First page is fetched on its own as it also tells how many more pages there are to fetch
+    _response, total = get_contacts(0)
+    list_response = [_response]
+    iterator = list(range(1, math.ceil(total / 100)))
+    with Parallel(n_jobs = 10, backend = "threading", verbose = 0) as parallel:
+        # Bounced pages are fetched a batch at a time & stop once the last page fetched reaches contacts 
+        # bounced on or before `start_date`, as every page after it is older still
+        # If the pages turn out not to be ordered by bounced date, every page is fetched instead
+        if kind == "bounced":
+            for i in range(0, len(iterator), 10):
+                if (list_response[-1]["bounced_date"].str[:10] <= start_date.isoformat()).any() \
+                   and is_bounced_desc(list_response):
+                    break
+                _response = parallel(
+                    delayed(get_contacts)(j) for j in iterator[i : i + 10]
+                    )
+                list_response.extend(j for j, _ in _response)
+        if kind == "unsubbed":
+            _response = parallel(
+                delayed(get_contacts)(i) for i in iterator
+                )
+            list_response.extend(j for j, _ in _response)
+    
+    return list_response
 
 # Process welcome mailing list files
 to_import_from_JO = list()
 for i in files_sharepoint_from_JO:
     if (i["Name"].endswith(".xlsx")) or (i["Name"].endswith(".xls")):
-        df = pd.read_excel(BytesIO(folder_sharepoint_from_JO.get_file(i).decode("utf-8")))
+        df = read_excel_file(folder_sharepoint_from_JO.get_file(i["Name"]), i["Name"])
     if i["Name"].endswith(".csv"):
-        df = pd.read_csv(StringIO(folder_sharepoint_from_JO.get_file(i).decode("utf-8")))
+        df = read_csv_file(folder_sharepoint_from_JO.get_file(i["Name"]), ["DOB", "1stDebitDate"])
     df["DOB"] = df["DOB"].astype("str")
     df["1stDebitDate"] = df["1stDebitDate"].astype("str")
-    df["listid"] = np.select([
-                                 "Welcome" in i.split(".")[0] # Donor Series - Welcome - Australia
-                                 "1stWeekEmail" in i.split(".")[0] # Donor Series - Australia
-                                 "2ndMonthEmail" in i.split(".")[0] # Donor Series - Month 2 - Australia   
-                                 "3rdMonthEmail" in i.split(".")[0] # Donor Series - Month 3 - Australia
-                                 "2YearEmail" in i.split(".")[0] # Donor Series - 2 Years - Australia    
-                             ],
-                             [
-                                 "71",
-                                 "26",
-                                 "246",
-                                 "241",           
-                                 "72"
-                             ])
-    dict_df = df.to_dict()
-    for j in range(len(df)):
+    # Whole file goes to the same ActiveCampaign List, so it's looked up once from the file name
+    tag = i["Name"].split("\\")[-1].split(".")[0]
+    listid = next((v for k, v in lists_from_JO if k in tag), None)
+    # Pull each column out as a plain Python list once & walk them in lockstep
+    # Blank cells are sent as JSON null, as NaN isn't valid JSON
+    _df = df[columns_from_JO].astype("object")
+    _df = _df.where(_df.notna(), None)
+    for email, first_name, last_name, phone, *values in zip(*_df.to_dict(orient = "list").values()):
         to_import_from_JO.append(
             {
-                "email": dict_df["Email"][j],
-                "first_name": dict_df["FirstName"][j],
-                "last_name": dict_df["Surname"][j],
-                "phone": dict_df["Mobile"][j],
+                "email": email,
+                "first_name": first_name,
+                "last_name": last_name,
+                "phone": phone,
                 "tags": [
-                    i.split("\\")[-1].split(".")[0]
-                ],
-                "fields": [                
-                    {"id": 2, "value": dict_df["SerialNum"][j]}, # RE - Constituent ID
-                    {"id": 5, "value": dict_df["Title"][j]}, # Title
-                    {"id": 24, "value": dict_df["Address"][j]}, # Address
-                    {"id": 25, "value": dict_df["Suburb"][j]}, # Suburb
-                    {"id": 26, "value": dict_df["State"][j]}, # State
-                    {"id": 27, "value": dict_df["Postcode"][j]}, # Postcode
-                    {"id": 28, "value": dict_df["DOB"][j]}, # DOB
-                    {"id": 29, "value": dict_df["1stDebitDate"][j]}, #1stDebitDate
-                    {"id": 30, "value": dict_df["Amount"][j]} # Amount
+                    tag
                 ],
+                "fields": [{"id": k, "value": v} for k, v in zip(fields_id_from_JO, values)],
                 "subscribe": [
-                    {"listid": df["listid"][j]} # ActiveCampaign List to subscribe to
-                ]
+                    {"listid": listid} # ActiveCampaign List to subscribe to
+                ] if listid else []
             }
         )
-payload = {
-    "contacts": to_import_from_JO
-}
-payload_index = payload_parser(payload)
-for i in range(len(payload_index) - 1):
-    _payload = {
-        "contacts": to_import_from_JO[payload_index[i] : payload_index[i + 1]]
-    }  
-    requests.post(url, 
-                  json = _payload, 
-                  headers = headers_post_bulk_import_contact)
-    time.sleep(1) # Limiter to accomodate ActiveCampaign's API policy of max 5 requests per second 
+to_import_from_JO = dedupe_contacts(to_import_from_JO)
+import_contacts(to_import_from_JO)
 
 # Process contacts for segementation
 to_import_from_NO = list()
 for i in files_sharepoint_from_NO:
     if (i["Name"].endswith(".xlsx")) or (i["Name"].endswith(".xls")):
-        df = pd.read_excel(BytesIO(folder_sharepoint_from_NO.get_file(i).decode("utf-8")))
+        df = read_excel_file(folder_sharepoint_from_NO.get_file(i["Name"]), i["Name"])
     if i["Name"].endswith(".csv"):
-        df = pd.read_csv(StringIO(folder_sharepoint_from_NO.get_file(i).decode("utf-8")))
+        df = read_csv_file(folder_sharepoint_from_NO.get_file(i["Name"]), ["Constituent Number"])
     df["Constituent Number"] = df["Constituent Number"].astype("str")
+    # Scan each Appeal & Package keyword once as plain substrings & reuse masks across conditions
+    au = df["Appeal"].str.contains("AU", regex = False, na = False)
+    nz = df["Appeal"].str.contains("NZ", regex = False, na = False)
+    active = df["Package"].str.contains("Active", regex = False, na = False)
+    lapsed = df["Package"].str.contains("Lapsed", regex = False, na = False)
+    noninsight = df["Package"].str.contains("NonInsight", regex = False, na = False)
+    insight = df["Package"].str.contains("Insight", regex = False, na = False) & ~noninsight
+    other = df["Package"].str.contains("Other", regex = False, na = False)
     df["listid"] = np.select([
-                                 df["Appeal"].str.contains("AU") & df["Package"].str.contains("Active"), # RG Active
-                                 df["Appeal"].str.contains("AU") & df["Package"].str.contains("Lapsed"), # RG Lapsed
-                                 df["Appeal"].str.contains("AU") & df["Package"].str.contains("Insight"), # SG Insight
-                                 df["Appeal"].str.contains("AU") & df["Package"].str.contains("NonInsight"), # SG NonInsight
+                                 au & active, # RG Active
+                                 au & lapsed, # RG Lapsed
+                                 au & insight, # SG Insight
+                                 au & noninsight, # SG NonInsight
                                  # AU Philantrophy - currently not in use but still listed just in case 
-                                 df["Appeal"].str.contains("NZ") & df["Package"].str.contains("Active"), # NZ RG Active
-                                 df["Appeal"].str.contains("NZ") & df["Package"].str.contains("Lapsed"), # NZ RG Lapsed
-                                 df["Appeal"].str.contains("NZ") & df["Package"].str.contains("Other"), # Newsletter NZ
+                                 nz & active, # NZ RG Active
+                                 nz & lapsed, # NZ RG Lapsed
+                                 nz & other, # Newsletter NZ
                              ],
                              [
                                  "199",
@@ -246,75 +485,52 @@ for i in files_sharepoint_from_NO:
                                  "256",
                                  "254",
                                  "258"
-                             ])
-    dict_df = df.to_dict()
-    for j in range(len(df)):
+                             ], 
+                             default = "") # No ActiveCampaign List matched
+    # Pull each column out as a plain Python list once & walk them in lockstep
+    df["tag"] = i["Name"].split(".")[0] + "_" + df["Package"].str.split("_").str[-1].str.split("-").str[0]
+    # Blank cells are sent as JSON null, as NaN isn't valid JSON
+    _df = df[columns_from_NO].astype("object")
+    _df = _df.where(_df.notna(), None)
+    for email, first_name, last_name, tag, listid, *values in zip(*_df.to_dict(orient = "list").values()):
         to_import_from_NO.append(
             {
-                "email": dict_df["Email Address"][j],
-                "first_name": dict_df["First name"][j],
-                "last_name": dict_df["Last name"][j],
+                "email": email,
+                "first_name": first_name,
+                "last_name": last_name,
                 "tags": [
-                    i.split(".")[0] + "_" + df["Package"][j].split("_")[-1].split("-")[0]
-                ],
-                "fields": [                
-                    {"id": 2, "value": dict_df["Constituent Number"][j]}, # RE - Constituent ID
-                    {"id": 5, "value": dict_df["Title"][j]}, # Title
-                    {"id": 96, "value": dict_df["Appeal"][j]}, # Appeal ID
-                    {"id": 97, "value": dict_df["Package"][j]}, # Package ID
-                    {"id": 134, "value": dict_df["Description"][j]}, # Description
-                    {"id": 113, "value": dict_df["Informal Salutation"][j]}, # Informal Salutation
-                    {"id": 46, "value": dict_df["Fullname"][j]} # First & Last Name
+                    tag
                 ],
+                "fields": [{"id": k, "value": v} for k, v in zip(fields_id_from_NO, values)],
                 "subscribe": [
-                    {"listid": df["listid"][j]} # ActiveCampaign List to subscribe to
-                ]
+                    {"listid": listid} # ActiveCampaign List to subscribe to
+                ] if listid else []
             }
         )
-payload = {
-    "contacts": to_import_from_NO
-}
-payload_index = payload_parser(payload)
-for i in range(len(payload_index) - 1):
-    _payload = {
-        "contacts": to_import_from_NO[payload_index[i] : payload_index[i + 1]]
-    }  
-    requests.post(url, 
-                  json = _payload, 
-                  headers = headers_post_bulk_import_contact)
-    time.sleep(1) # Limiter to accomodate ActiveCampaign's API policy of max 5 requests per second 
+to_import_from_NO = dedupe_contacts(to_import_from_NO)
+import_contacts(to_import_from_NO)
 
 # Collate bounced contacts
-response = requests.get(url_bounced_contact, headers = headers_get_bounced_unsubbed_contact, 
-                        params = {"limit": 1})
-iterator = range(math.ceil(int(response.json()["meta"]["total"]) / 100))
-list_response = process_contacts(iterator, "bounced")
-df_contacts_bounced = pd.DataFrame([i for j in list_response for i in j])
-df_contacts_bounced["bounced_date"] = pd.to_datetime(df_contacts_bounced["bounced_date"]).dt.date
+list_response = process_contacts("bounced")
+df_contacts_bounced = pd.concat(list_response, ignore_index = True)
+df_contacts_bounced["bounced_date"] = pd.to_datetime(df_contacts_bounced["bounced_date"], format = "%Y-%m-%d").dt.date
 df_contacts_bounced = df_contacts_bounced[(df_contacts_bounced["bounced_date"] > start_date) \
                                           & (df_contacts_bounced["bounced_date"] < end_date)]
-df_contacts_bounced["RE - Constituent ID"] = process_cons_id(df_contacts_bounced["id"])
 df_contacts_bounced = df_contacts_bounced.drop(labels = "id", axis = 1).rename(columns = {"email": "Email", 
                                                                                           "firstName": "First Name",
                                                                                           "lastName": "Last Name",
                                                                                           "bounced_date": "Bounced Date"})
 df_contacts_bounced.to_csv(".csv", index = False)
 
-# Limiter to accomodate ActiveCampaign's API policy of max 5 requests per second
-# Overshot to ensure enough time gap
-time.sleep(3)
-
 # Collate unsubbed contacts
-response = requests.get(url_unsubbed_contact, headers = headers_get_bounced_unsubbed_contact, 
-                        params = {"limit": 1})
-iterator = range(math.ceil(int(response.json()["meta"]["total"]) / 100))
-list_response = process_contacts(iterator, "unsubbed")
-df_contacts_unsubbed = pd.DataFrame([i for j in list_response for i in j])
-df_contacts_unsubbed["cdate"] = pd.to_datetime(df_contacts_unsubbed["cdate"].str.split("T").str[0]).dt.date
-df_contacts_unsubbed["udate"] = pd.to_datetime(df_contacts_unsubbed["udate"].str.split("T").str[0]).dt.date
+list_response = process_contacts("unsubbed")
+df_contacts_unsubbed = pd.concat(list_response, ignore_index = True)
+# Only the date part of the timestamp, in ActiveCampaign's account timezone, is parsed with an explicit format
+df_contacts_unsubbed[["cdate", "udate"]] = df_contacts_unsubbed[["cdate", "udate"]].apply(
+    lambda x: pd.to_datetime(x.str[:10], format = "%Y-%m-%d").dt.date
+    )
 df_contacts_unsubbed = df_contacts_unsubbed[(df_contacts_unsubbed["udate"] > start_date) \
                                           & (df_contacts_unsubbed["udate"] < end_date)]
-df_contacts_unsubbed["RE - Constituent ID"] = process_cons_id(df_contacts_unsubbed["id"])
 df_contacts_unsubbed = df_contacts_unsubbed.drop(labels = "id", axis = 1).rename(columns = {"email": "Email", 
                                                                                             "firstName": "First Name",
                                                                                             "lastName": "Last Name",
@@ -337,16 +553,18 @@ df_logs = pd.DataFrame(
     }
 )
 # If log file exists, append newest log data & update
-if any(i["Name"] == "runtime_logs.csv" for i in folder_sharepoint_log_dump.files()):
-    _df_logs = pd.read_csv(StringIO(folder_sharepoint_log_dump.get_file("runtime_logs.csv").decode("utf-8")))
-    _df_logs.append(df_logs, ignore_index = True)
-    buffer = StringIO()
-    _df_logs.to_csv(buffer, index = False, header = True)
-    df_logs_to_upload = buffer.getvalue()
-    folder_sharepoint_log_dump.upload_file(df_logs_to_upload, "runtime_logs.csv")
-# Otherwise create a new log file & upload for future use
-else:
-    buffer = StringIO()
-    df_logs.to_csv(buffer, index = False, header = True)
-    df_logs_to_upload = buffer.getvalue()
-    folder_sharepoint_log_dump.upload_file(df_logs_to_upload, "runtime_logs.csv")
\ No newline at end of file
+# Local copy is used instead of downloading the log file if SharePoint still has the version last uploaded
+log_state = get_log_state()
+if log_state is not None:
+    if os.path.exists(path_log_cache) and read_log_state() == log_state:
+        _df_logs = pd.read_csv(path_log_cache)
+    else:
+        _df_logs = pd.read_csv(BytesIO(folder_sharepoint_log_dump.get_file("runtime_logs.csv")))
+    df_logs = pd.concat([_df_logs, df_logs], ignore_index = True)
+# Otherwise a new log file is created & uploaded for future use
+df_logs_to_upload = df_logs.to_csv(index = False, header = True)
+folder_sharepoint_log_dump.upload_file(df_logs_to_upload, "runtime_logs.csv")
+with open(path_log_cache, "w", newline = "") as f:
+    f.write(df_logs_to_upload)
+with open(path_log_state, "w") as f:
+    json.dump(get_log_state(), f)